@@ -1,248 +1,677 @@
 """
 Azure Functions Python HTTP Trigger for Alma Analytics API Call
 """
-import json
+import asyncio
 import logging
-from typing import Any
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable
 import urllib.parse
 import azure.functions as func
-from bs4 import BeautifulSoup  # type:ignore[import-untyped]
-from dotenv import load_dotenv
-import requests  # type:ignore[import-untyped]
-from barcodecheck_models.area import get_area_by_name  # type:ignore[import-untyped]
-from barcodecheck_models.apikey import get_api_key_by_area_and_iz  # type:ignore[import-untyped]
-from barcodecheck_models.iz import get_iz_by_code  # type:ignore[import-untyped]
-from barcodecheck_models.izanalysis import get_iz_analysis_by_iz_and_analysis  # type:ignore[import-untyped]
-from barcodecheck_models.analysis import get_analysis_by_name  # type:ignore[import-untyped]
+import orjson
 
-load_dotenv()  # Load environment variables from .env file
+# aiohttp, lxml and barcodecheck_models are imported where they are used to keep cold starts short
+# pylint: disable=import-outside-toplevel
+if TYPE_CHECKING:
+    import aiohttp
+
+if os.getenv('WEBSITE_INSTANCE_ID') is None:  # Not hosted on Azure, where settings come from the platform
+    from dotenv import load_dotenv
+    load_dotenv()  # Load environment variables from .env file
 
 app = func.FunctionApp()  # Create an instance of the FunctionApp class
 
+NAMESPACES: dict[str, str] = {  # XML namespaces used in Alma Analytics responses
+    'xsd': 'http://www.w3.org/2001/XMLSchema',
+    'saw-sql': 'urn:saw-sql',
+    'rowset': 'urn:schemas-microsoft-com:xml-analysis:rowset',
+    'xmlbeans': 'http://com/exlibris/urm/general/xmlbeans',
+}
+
+XSD_ELEMENT = f"{{{NAMESPACES['xsd']}}}element"  # Column schema element
+SAW_COLUMN_HEADING = f"{{{NAMESPACES['saw-sql']}}}columnHeading"  # Column heading attribute
+ROW = f"{{{NAMESPACES['rowset']}}}Row"  # Data row element
+NAME = 'name'  # Column name attribute
+RESUMPTION_TOKEN = 'ResumptionToken'  # Resume token element
+IS_FINISHED = 'IsFinished'  # Report finished flag element
+TEXT_TAGS = frozenset({  # Elements outside rows whose text is collected
+    RESUMPTION_TOKEN,
+    IS_FINISHED,
+    f"{{{NAMESPACES['xmlbeans']}}}error",  # API error
+    'error',  # API error without namespace
+})
+FIRST_COLUMN = 'Column0'  # Row number column, skipped when headings are known
+PROVENANCE_MARKER = 'CASE  WHEN Provenance Code'  # Heading of the calculated Provenance Code column
+MAX_PAGES = 10  # Most report pages fetched by one request, to stay within the HTTP timeout and memory
+CHUNK_SIZE = 64 * 1024  # Bytes of the Alma response fed to the parser at a time
+PARSERS: list[tuple[Any, 'ReportTarget']] = []  # Idle parsers and their targets, reused across invocations
+POOL_SIZE = 4  # Most idle parsers kept in PARSERS
+
+CACHE_TTL = 300  # Seconds to cache database lookups on a warm worker
+
+EXECUTOR = ThreadPoolExecutor(max_workers=4)  # Runs independent database lookups concurrently
+
+ALMA_ANALYTICS_URL = 'https://api-na.hosted.exlibrisgroup.com/almaws/v1/analytics/reports'
+RETRY_TOTAL = 3  # Retries for failed Alma API calls
+RETRY_BACKOFF = 0.2  # Seconds, doubled after each retry
+RETRY_STATUSES = frozenset({502, 503, 504})  # Alma API statuses worth retrying
+
+SESSION: 'aiohttp.ClientSession | None' = None  # Reused across invocations to keep Alma API connections alive
+SESSION_LOCK = asyncio.Lock()  # Guards lazy creation of SESSION
+
 
 @app.route(route="httpalmaanalytics", methods=['POST'], auth_level=func.AuthLevel.FUNCTION)
-def httpalmaanalytics(req: func.HttpRequest) -> func.HttpResponse:
+async def httpalmaanalytics(req: func.HttpRequest) -> func.HttpResponse:
     """
     Azure Function to handle HTTP requests for Alma Analytics API calls.
 
     :param req:
     :return: func.HttpResponse
     """
-    payload = set_payload(req)  # Set the payload for the API call
+    req_body = get_request_body(req)  # Parse the request body once
+
+    if isinstance(req_body, func.HttpResponse):
+        return req_body
+
+    pages = req_body.get('pages', 1)  # Number of report pages to fetch
+
+    if not isinstance(pages, int) or isinstance(pages, bool) or not 1 <= pages <= MAX_PAGES:  # Validate pages
+        logging.error("Invalid pages %s in POST request body", pages)
+        return func.HttpResponse(f"Pass pages as an integer from 1 to {MAX_PAGES} in the request body", status_code=400)
+
+    payload = await set_payload(req_body)  # Set the payload for the API call
 
     if isinstance(payload, func.HttpResponse):
         return payload
 
-    response = make_api_call(payload=payload)  # Make API call
-
-    if isinstance(response, func.HttpResponse):
-        return response
+    columns = req_body.get('columns')  # Columns from request body, used if not found in XML
+    report: dict[str, Any] = {'columns': {}, 'resume': None, 'is_finished': None, 'error': None}
+    rows = bytearray()  # JSON-encoded rows, comma separated
 
-    soup = get_soup(response)  # Parse the XML response
+    token = payload.get('token')  # Resume token from the request; Alma only sends one on the first page
 
-    if isinstance(soup, func.HttpResponse):
-        return soup
+    for page in range(pages):
+        if page:  # Follow-up pages continue from the resume token
+            token = report['resume'] or token
+            if report['is_finished'] == 'true' or not token:
+                break
+            payload.pop('path', None)
+            payload['token'] = token
 
-    columns = get_columns(soup)  # Get the columns from the XML response
+        response = await make_api_call(payload=payload)  # Make API call
 
-    if not columns:
-        columns = req.get_json().get('columns')  # Get columns from request body if not found in XML
+        if isinstance(response, func.HttpResponse):
+            return response
 
-    rows = get_rows(soup, columns)  # Get the rows from the XML response
+        error = await read_report(response, report, columns, rows)  # Stream the rows from the XML response
 
-    if isinstance(rows, func.HttpResponse):
-        return rows
+        if error is not None:
+            return error
 
-    resume_data: Any = soup.find('ResumptionToken')  # Get the resume token
-    is_finished = soup.find('IsFinished')  # Check if the report is finished
+    if not rows:
+        logging.error('No rows found')  # Log error
+        return func.HttpResponse("No rows found", status_code=404)
 
     return func.HttpResponse(  # Return the response
-        json.dumps(
-            {
-                'status': 'success',
-                'data': {
-                    'resume': resume_data.text if resume_data else None,
-                    'is_finished': is_finished.text if is_finished else None,
-                    'columns': columns,
-                    'rows': rows,
-                },
-            }
-        ),
+        get_response_body(report, report['columns'] or columns, rows),
         mimetype='application/json',
         status_code=200
     )
 
 
-def set_payload(req: func.HttpRequest) -> str | func.HttpResponse:
+async def read_report(
+        response: 'aiohttp.ClientResponse',
+        report: dict[str, Any],
+        columns: dict[str, str] | None,
+        rows: bytearray
+) -> func.HttpResponse | None:
     """
-    Set the payload for the API call.
+    Read one page of the report, appending its JSON-encoded rows to ``rows``
+
+    :param response: aiohttp.ClientResponse (streamed)
+    :param report: Report metadata dictionary
+    :param columns: Fallback columns dictionary
+    :param rows: JSON-encoded rows, comma separated
+    :return: func.HttpResponse on errors, otherwise None
+    """
+    import aiohttp
+    from lxml import etree  # type:ignore[import-untyped]
+
+    try:
+        async for row in iter_report(response, report, columns):  # Stream rows from the XML response
+            if rows:
+                rows += b','
+            rows += orjson.dumps(row)  # Encode each row as it is parsed
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:  # Handle errors reading the response
+        return func.HttpResponse(f"API call failed: {e}", status_code=500)
+    except etree.XMLSyntaxError:  # Check for empty or invalid XML
+        logging.error('Empty or invalid XML response')  # Log error
+        return func.HttpResponse("Empty or invalid XML response", status_code=404)
+    finally:
+        response.release()  # Release the connection
+
+    if report['error'] is not None:  # Check for errors
+        logging.error('Error: %s', report['error'])
+        return func.HttpResponse(f"Error: {report['error']}", status_code=500)
+
+    return None
+
+
+def get_response_body(report: dict[str, Any], columns: dict[str, str] | None, rows: bytearray) -> bytes:
+    """
+    Build the JSON response body around the already encoded rows
+
+    :param report: Report metadata dictionary
+    :param columns: Columns dictionary
+    :param rows: JSON-encoded rows, comma separated
+    :return: JSON response body
+    """
+    return b''.join((  # Copies the rows once, straight into the body
+        b'{"status":"success","data":{"resume":',
+        orjson.dumps(report['resume']),
+        b',"is_finished":',
+        orjson.dumps(report['is_finished']),
+        b',"columns":',
+        orjson.dumps(columns),
+        b',"rows":[',
+        rows,
+        b']}}',
+    ))
+
+
+def get_request_body(req: func.HttpRequest) -> dict[str, Any] | func.HttpResponse:
+    """
+    Parse the HTTP request body.
 
     :param req: HTTP request
-    :return: Payload string
+    :return: Request body dictionary
     """
-    # HTTP request body
     try:
-        req_body: Any = req.get_json()  # Get the request body as JSON
-    except ValueError:
+        req_body = orjson.loads(req.get_body())  # Get the request body as JSON
+    except orjson.JSONDecodeError:
+        req_body = None
+
+    if not isinstance(req_body, dict):
         logging.error("Invalid JSON in request body")
         return func.HttpResponse("Invalid JSON in request body", status_code=400)
 
-    if not req_body.get('iz') or not req_body.get('analysis'):  # Validate parameters
-        logging.error("Missing required parameters in POST request body")
+    return req_body
+
+
+async def set_payload(req_body: dict[str, Any]) -> dict[str, str] | func.HttpResponse:
+    """
+    Set the payload for the API call.
+
+    :param req_body: HTTP request body
+    :return: Payload dictionary
+    """
+    iz_code = req_body.get('iz')
+    analysis_name = req_body.get('analysis')
+    resume = req_body.get('resume')
+
+    if not (  # Validate parameters; iz and analysis key the cached lookups, so only strings are accepted
+            iz_code and isinstance(iz_code, str)
+            and analysis_name and isinstance(analysis_name, str)
+            and isinstance(resume, str | None)
+    ):
+        logging.error("Missing or invalid parameters in POST request body")
         return func.HttpResponse("Pass iz, and analysis in the request body", status_code=400)
 
-    # Alma API area
-    area = get_area_by_name('analytics')  # Get area by name
+    epoch = cache_epoch()  # Cache epoch for the lookups below
+
+    loop = asyncio.get_running_loop()
+
+    # Independent lookups: Alma API area, IZ, and Analytics analysis
+    area, iz, analysis = await asyncio.gather(
+        loop.run_in_executor(EXECUTOR, _area, 'analytics', epoch),  # Get area by name
+        loop.run_in_executor(EXECUTOR, _iz, iz_code, epoch),  # Get IZ by code
+        loop.run_in_executor(EXECUTOR, _analysis, analysis_name, epoch),  # Get analysis by name
+    )
 
     if not area:  # If area is None, return 404
         logging.error("Area %s not found", req_body.get('area'))
         return func.HttpResponse("Area not found", status_code=404)
 
-    # Alma IZ
-    iz = get_iz_by_code(req_body.get('iz'))  # Get IZ by code
-
     if not iz:  # If iz is None, return 404
-        logging.error("IZ %s not found", req_body.get('iz'))
+        logging.error("IZ %s not found", iz_code)
         return func.HttpResponse("IZ not found", status_code=404)
 
-    # Alma Analytics analysis
-    analysis = get_analysis_by_name(req_body.get('analysis'))  # Get analysis by name
-
     if not analysis:  # If iz is None, return 404
-        logging.error("Analytics Analysis %s not found", req_body.get('analysis'))
+        logging.error("Analytics Analysis %s not found", analysis_name)
         return func.HttpResponse("Analysis not found", status_code=404)
 
-    # IZ-specific Analytics analysis
-    iz_analysis = get_iz_analysis_by_iz_and_analysis(iz, analysis)  # Get report path by IZ and analysis
+    # Dependent lookups: IZ-specific Analytics analysis and API key
+    iz_analysis, apikey = await asyncio.gather(
+        loop.run_in_executor(  # Get report path by IZ and analysis
+            EXECUTOR, _iz_analysis, iz_code, analysis_name, epoch
+        ),
+        loop.run_in_executor(EXECUTOR, _apikey, area.id, iz.id, epoch),  # Get API key by area and IZ
+    )
 
     if not iz_analysis:  # If iz_analysis is None, return 404
         logging.error("Analytics Analysis %s for IZ %s not found", analysis.name, iz.code)
         return func.HttpResponse("Report path not found", status_code=404)
 
-    # API key
-    apikey = get_api_key_by_area_and_iz(area.id, iz.id, False)  # Get API key by area and IZ
-
     if not apikey:  # If apikey is None, return 404
         logging.error("Read-only Analytics API Key not found for %s", iz.code)
         return func.HttpResponse("API key not found", status_code=404)
 
-    # Resume token
-    resume: Any | None = req_body.get('resume') if 'resume' in req_body else None  # Get resume token
-
     logging.info("Resume token: %s", resume)  # Log the resume token
 
-    payload_dict = {
+    payload = {
         "apikey": apikey.apikey,  # API key
         'limit': '1000',  # limit (max 1000)
         'col_names': 'true'  # include column names
     }
 
     if resume:
-        payload_dict['token'] = resume  # resume token, if provided
+        payload['token'] = resume  # resume token, if provided
 
     if not resume:
-        payload_dict['path'] = iz_analysis.path  # otherwise report path
-
-    payload = urllib.parse.urlencode(
-        payload_dict,
-        safe=':%'  # noqa: WPS432
-    )
+        payload['path'] = urllib.parse.unquote(iz_analysis.path)  # otherwise report path, encoded once by aiohttp
 
     logging.info("Payload: %s", payload)  # Log the payload
 
     return payload
 
 
-def make_api_call(payload: str) -> requests.Response | func.HttpResponse | None:
+async def get_session() -> 'aiohttp.ClientSession':
+    """
+    Get the shared Alma API client session, creating it on first use.
+
+    :return: aiohttp.ClientSession
+    """
+    import aiohttp
+
+    global SESSION  # pylint: disable=global-statement
+
+    async with SESSION_LOCK:
+        if SESSION is None or SESSION.closed:
+            SESSION = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=8),  # Connection pool size
+                headers={'Accept-Encoding': 'gzip, deflate'},  # Compressed XML
+                timeout=aiohttp.ClientTimeout(sock_connect=5, sock_read=600),  # Connect and read timeouts
+            )
+
+    return SESSION
+
+
+async def make_api_call(payload: dict[str, str]) -> 'aiohttp.ClientResponse | func.HttpResponse':
     """
     Make the API call.
 
-    :param payload: Payload string
-    :return: requests.Response | None
+    Connection errors and 502/503/504 responses are retried with backoff.
+
+    :param payload: Payload dictionary
+    :return: aiohttp.ClientResponse | func.HttpResponse
     """
-    url: str = 'https://api-na.hosted.exlibrisgroup.com/almaws/v1/analytics/reports'
+    import aiohttp
 
-    try:
-        response = requests.get(url, params=payload, timeout=600)
-        response.raise_for_status()  # Check for HTTP errors
-    except (requests.exceptions.RequestException, requests.exceptions.HTTPError) as e:  # Handle exceptions
-        return func.HttpResponse(f"API call failed: {e}", status_code=500)
+    session = await get_session()
+    error: Exception | None = None
 
-    return response
+    for attempt in range(RETRY_TOTAL + 1):
+        if attempt:
+            await asyncio.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))  # Back off before retrying
 
+        try:
+            response = await session.get(ALMA_ANALYTICS_URL, params=payload)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:  # Handle exceptions
+            error = e
+            continue
 
-def get_soup(response: requests.Response) -> BeautifulSoup | func.HttpResponse:
+        if response.status in RETRY_STATUSES and attempt < RETRY_TOTAL:
+            response.release()
+            continue
+
+        try:
+            response.raise_for_status()  # Check for HTTP errors
+        except aiohttp.ClientResponseError as e:
+            response.release()
+            error = e
+            break
+
+        return response
+
+    return func.HttpResponse(f"API call failed: {error}", status_code=500)
+
+
+async def iter_report(
+        response: 'aiohttp.ClientResponse',
+        report: dict[str, Any],
+        columns: dict[str, str] | None
+) -> AsyncIterator[dict[str, str]]:
     """
-    Parse the XML response
+    Stream the data rows from the XML response
 
-    :param response: requests.Response
-    :return: BeautifulSoup
+    Column headings, the resume token, the finished flag and any API error are
+    recorded in ``report`` as their elements are parsed.
+
+    :param response: aiohttp.ClientResponse (streamed)
+    :param report: Report metadata dictionary
+    :param columns: Fallback columns dictionary
+    :return: Async iterator of row dictionaries
     """
-    soup = BeautifulSoup(response.content, 'xml')  # Parse XML response
+    parser, target = get_parser(report, columns)
 
-    if not soup:  # Check for empty or errors
-        logging.error('Empty or invalid XML response')  # Log error
-        return func.HttpResponse("Empty or invalid XML response", status_code=404)
+    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+        parser.feed(chunk)
+        for row in target.rows:  # Rows completed by this chunk
+            yield row
+        target.rows.clear()
+        if report['error'] is not None:  # Stop on API errors, discarding the half-fed parser
+            return
 
-    if soup.find('error'):  # Check for errors
-        logging.error('Error: %s', soup.find('error').text)  # type:ignore[union-attr]
-        return func.HttpResponse(f"Error: {soup.find('error').text}", status_code=500)  # type:ignore[union-attr]
+    for row in parser.close():  # Rows completed by the last chunk
+        yield row
 
-    return soup
+    if len(PARSERS) < POOL_SIZE:  # Return the parser to the pool once the document is complete
+        target.release()
+        PARSERS.append((parser, target))
 
 
-def get_columns(soup: BeautifulSoup) -> dict[str, str] | None:  # type:ignore[valid-type]
+def get_parser(report: dict[str, Any], columns: dict[str, str] | None) -> tuple[Any, 'ReportTarget']:
     """
-    Get the data rows from the report
+    Get an idle parser from the pool, or create one
+
+    A pool rather than a thread-local parser, because concurrent invocations
+    interleave on the worker's event loop thread.
 
-    :param soup: BeautifulSoup
-    :return: list or None
+    :param report: Report metadata dictionary
+    :param columns: Fallback columns dictionary
+    :return: etree.XMLParser and its ReportTarget
     """
-    columnlist: Any = soup.find_all('xsd:element')  # Get the columns from the XML response
+    from lxml import etree  # type:ignore[import-untyped]
+
+    if PARSERS:
+        parser, target = PARSERS.pop()
+        target.reset(report, columns)
+        return parser, target
+
+    target = ReportTarget(report, columns)
+    parser = etree.XMLParser(  # Parse into the target without building a tree
+        target=target,
+        huge_tree=True,  # Allow very large text nodes and deep documents
+        collect_ids=False,  # Reports don't use xml:id
+    )
 
-    if not columnlist:
-        return None  # type:ignore[return-value] # Return None if no columns found
+    return parser, target
 
-    columns = {}  # Create a dictionary of columns
 
-    for column in columnlist:  # Iterate through the columns
-        columns[column['name']] = column['saw-sql:columnHeading']  # Add column to dictionary
-        if 'CASE  WHEN Provenance Code' in column['saw-sql:columnHeading']:
-            columns[column['name']] = 'Provenance Code'  # Change column name to Provenance Code
+class ReportTarget:
+    """
+    lxml parser target that collects row dictionaries from the XML response
+    """
 
-    return columns  # type: ignore # Return the dictionary of columns
+    report: dict[str, Any]  # Report metadata dictionary
+    columns: dict[str, str] | None  # Fallback columns dictionary
+    rows: list[dict[str, str]]  # Completed rows not yet yielded
+    row: dict[str, str] | None  # Row being parsed
+    field: str | None  # Tag of the element whose text is being collected
+    text: list[str]  # Text of the element being collected
+    keys: dict[str, str | None]  # Row key for each column tag, None to skip the column
+
+    def __init__(self, report: dict[str, Any], columns: dict[str, str] | None) -> None:
+        self.reset(report, columns)
+
+    def reset(self, report: dict[str, Any], columns: dict[str, str] | None) -> None:
+        """
+        Reset the target to parse another document
+
+        :param report: Report metadata dictionary
+        :param columns: Fallback columns dictionary
+        :return: None
+        """
+        self.report = report
+        self.columns = columns
+        self.rows = []
+        self.row = None
+        self.field = None
+        self.text = []
+        self.keys = {}
+
+    def release(self) -> None:
+        """
+        Drop the finished invocation's state before the target goes back to the pool
+
+        :return: None
+        """
+        self.reset({}, None)  # Empty, so the pool keeps no report or columns alive
+
+    def start(self, tag: str, attrib: dict[str, str]) -> None:
+        """
+        Handle an element start tag
+
+        :param tag: Tag name
+        :param attrib: Attributes
+        :return: None
+        """
+        if self.field is not None:  # Nested in an element being collected, e.g. error details
+            return
+
+        if self.row is not None:  # Column of the current row
+            self.field = tag
+        elif tag == ROW:
+            self.row = {}
+        elif tag == XSD_ELEMENT:
+            name = sys.intern(attrib[NAME])  # Interned so every row shares the same key objects
+            self.report['columns'][name] = sys.intern(get_column(attrib))  # Add column to dictionary
+        elif tag in TEXT_TAGS:
+            self.field = tag
+
+        self.text = []
+
+    def data(self, data: str) -> None:
+        """
+        Handle element text
+
+        :param data: Text
+        :return: None
+        """
+        if self.field is not None:
+            self.text.append(data)
+
+    def end(self, tag: str) -> None:
+        """
+        Handle an element end tag
+
+        :param tag: Tag name
+        :return: None
+        """
+        if tag == ROW:
+            self.rows.append(self.row)  # type:ignore[arg-type]
+            self.row = None
+            return
+
+        if tag != self.field:
+            return
+
+        self.field = None
+        text = ''.join(self.text)
+
+        if self.row is not None:
+            self.add_value(tag, text)
+        elif tag == RESUMPTION_TOKEN:
+            self.report['resume'] = text  # Get the resume token
+        elif tag == IS_FINISHED:
+            self.report['is_finished'] = text  # Check if the report is finished
+        else:
+            self.report['error'] = text  # Get the error message
+
+    def add_value(self, tag: str, value: str) -> None:
+        """
+        Add a column value to the current row
+
+        :param tag: Column tag name
+        :param value: Column text
+        :return: None
+        """
+        if tag not in self.keys:  # Resolve each column tag once per report page
+            self.keys[tag] = self.get_key(tag)
+
+        key = self.keys[tag]
+
+        if key is not None:
+            self.row[key] = value  # type:ignore[index]
+
+    def get_key(self, tag: str) -> str | None:
+        """
+        Get the row key for a column tag
+
+        :param tag: Column tag name
+        :return: Column heading, or the tag name without namespace if not in mapping; None to skip the column
+        """
+        name = sys.intern(tag.rpartition('}')[2])  # Tag name without namespace
+        columns = self.report['columns'] or self.columns
+
+        if not columns:  # Keep the original names if no mapping
+            return name
+
+        if name == FIRST_COLUMN:  # Skip the first column
+            return None
+
+        return columns.get(name, name)
+
+    def close(self) -> list[dict[str, str]]:
+        """
+        Handle the end of the document; parser.close() returns this result
+
+        :return: Completed rows not yet yielded
+        """
+        return self.rows
+
+
+def get_column(attrib: dict[str, str]) -> str:
+    """
+    Get the heading of a column from its schema element attributes
 
+    :param attrib: Schema element attributes
+    :return: Column heading
+    """
+    heading = attrib[SAW_COLUMN_HEADING]
 
-def get_rows(soup: BeautifulSoup, columns: dict[str, str] | None) -> list[dict[str, str]] | func.HttpResponse:
+    return 'Provenance Code' if PROVENANCE_MARKER in heading else heading  # Rename Provenance Code column
+
+
+def cache_epoch() -> int:
     """
-    Get the data rows from the report
+    Get the current cache epoch, which changes every CACHE_TTL seconds.
 
-    :param soup: BeautifulSoup
-    :param columns: Columns dictionary
-    :return: list or None
+    Passing it to the cached lookups below expires their entries.
+
+    :return: int
     """
-    rowlist = soup.find_all('Row')  # Get the rows from the XML response
+    return int(time.monotonic() // CACHE_TTL)
 
-    if not rowlist:
-        logging.error('No rows found')  # Log error
-        return func.HttpResponse("No rows found", status_code=404)
 
-    rows = []  # Create a list of rows
+def cache_found(maxsize: int) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """
+    LRU cache decorator that only keeps results that are not None.
+
+    Unlike functools.lru_cache, a lookup for a record that doesn't exist yet
+    is retried on the next call instead of returning None until the epoch expires.
+
+    :param maxsize: Maximum number of cached results
+    :return: Decorator
+    """
+    def decorator(function: Callable[..., Any]) -> Callable[..., Any]:
+        cache: OrderedDict[tuple[Any, ...], Any] = OrderedDict()
+        lock = threading.Lock()  # Lookups run on the executor threads
+
+        @wraps(function)
+        def wrapper(*args: Any) -> Any:
+            with lock:
+                if args in cache:
+                    cache.move_to_end(args)  # Mark as most recently used
+                    return cache[args]
+
+            result = function(*args)
+
+            if result is not None:  # Don't cache misses
+                with lock:
+                    cache[args] = result
+                    if len(cache) > maxsize:
+                        cache.popitem(last=False)  # Evict the least recently used
+
+            return result
 
-    for value in rowlist:  # Iterate through the rows
-        values = {}  # Create a dictionary of values
-        kids = value.findChildren()  # type:ignore[union-attr] # Get the children of the row
+        return wrapper
 
-        for kid in kids:  # Iterate through the children
-            if not columns:
-                values[kid.name] = kid.text
-                continue
-            if kid.name != 'Column0':  # Skip the first column
-                if kid.name in columns:  # Use the column heading as the key
-                    values[columns[kid.name]] = kid.text  # Add the child to the dictionary
-                else:
-                    values[kid.name] = kid.text  # Fallback to the original name if not in mapping
+    return decorator
 
-        rows.append(values)  # Add the dictionary to the list
 
-    return rows  # Return the list of rows
+@cache_found(maxsize=32)
+def _area(name: str, epoch: int) -> Any:  # pylint: disable=unused-argument
+    """
+    Get an area by name (cached)
+
+    :param name: Area name
+    :param epoch: Cache epoch
+    :return: Area or None
+    """
+    from barcodecheck_models.area import get_area_by_name  # type:ignore[import-untyped]
+
+    return get_area_by_name(name)
+
+
+@cache_found(maxsize=32)
+def _iz(code: str, epoch: int) -> Any:  # pylint: disable=unused-argument
+    """
+    Get an IZ by code (cached)
+
+    :param code: IZ code
+    :param epoch: Cache epoch
+    :return: IZ or None
+    """
+    from barcodecheck_models.iz import get_iz_by_code  # type:ignore[import-untyped]
+
+    return get_iz_by_code(code)
+
+
+@cache_found(maxsize=32)
+def _analysis(name: str, epoch: int) -> Any:  # pylint: disable=unused-argument
+    """
+    Get an analysis by name (cached)
+
+    :param name: Analysis name
+    :param epoch: Cache epoch
+    :return: Analysis or None
+    """
+    from barcodecheck_models.analysis import get_analysis_by_name  # type:ignore[import-untyped]
+
+    return get_analysis_by_name(name)
+
+
+@cache_found(maxsize=32)
+def _iz_analysis(iz_code: str, analysis_name: str, epoch: int) -> Any:
+    """
+    Get an IZ-specific analysis by IZ code and analysis name (cached)
+
+    :param iz_code: IZ code
+    :param analysis_name: Analysis name
+    :param epoch: Cache epoch
+    :return: IZ analysis or None
+    """
+    from barcodecheck_models.izanalysis import get_iz_analysis_by_iz_and_analysis  # type:ignore[import-untyped]
+
+    return get_iz_analysis_by_iz_and_analysis(_iz(iz_code, epoch), _analysis(analysis_name, epoch))
+
+
+@cache_found(maxsize=32)
+def _apikey(area_id: int, iz_id: int, epoch: int) -> Any:  # pylint: disable=unused-argument
+    """
+    Get the read-only API key by area and IZ IDs (cached)
+
+    :param area_id: Area ID
+    :param iz_id: IZ ID
+    :param epoch: Cache epoch
+    :return: API key or None
+    """
+    from barcodecheck_models.apikey import get_api_key_by_area_and_iz  # type:ignore[import-untyped]
+
+    return get_api_key_by_area_and_iz(area_id, iz_id, False)
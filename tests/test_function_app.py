@@ -0,0 +1,543 @@
+"""
+Tests for the Alma Analytics HTTP trigger
+"""
+import asyncio
+import json
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Callable
+import aiohttp
+from aiohttp import web
+import azure.functions as func
+import pytest
+import function_app
+
+FIRST_PAGE = (
+    b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    b'<report><QueryResult><ResumptionToken>TOK</ResumptionToken><IsFinished>false</IsFinished>'
+    b'<ResultXml><rowset xmlns="urn:schemas-microsoft-com:xml-analysis:rowset">'
+    b'<xsd:schema xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:saw-sql="urn:saw-sql">'
+    b'<xsd:element name="Column0" saw-sql:columnHeading="0"/>'
+    b'<xsd:element name="Column1" saw-sql:columnHeading="Barcode"/>'
+    b'</xsd:schema>'
+    b'<Row><Column0>0</Column0><Column1>b1</Column1></Row>'
+    b'</rowset></ResultXml></QueryResult></report>'
+)
+
+
+def continuation_page(barcode: str, finished: str = 'false') -> bytes:
+    """
+    Build a follow-up report page, which has no schema and no resume token
+
+    :param barcode: Barcode in the page's only row
+    :param finished: IsFinished value
+    :return: XML response body
+    """
+    return (
+        f'<report><QueryResult><IsFinished>{finished}</IsFinished>'
+        f'<ResultXml><rowset xmlns="urn:schemas-microsoft-com:xml-analysis:rowset">'
+        f'<Row><Column0>0</Column0><Column1>{barcode}</Column1></Row>'
+        f'</rowset></ResultXml></QueryResult></report>'
+    ).encode()
+
+
+class FakeContent:  # pylint: disable=too-few-public-methods
+    """
+    Stand-in for aiohttp.StreamReader
+    """
+
+    def __init__(self, body: bytes) -> None:
+        self.body = body
+
+    async def iter_chunked(self, size: int) -> AsyncIterator[bytes]:
+        """
+        Yield the body in chunks
+
+        :param size: Chunk size
+        :return: Async iterator of chunks
+        """
+        for i in range(0, len(self.body), size):
+            yield self.body[i:i + size]
+
+
+class FakeResponse:  # pylint: disable=too-few-public-methods
+    """
+    Stand-in for aiohttp.ClientResponse
+    """
+
+    def __init__(self, body: bytes) -> None:
+        self.content = FakeContent(body)
+
+    def release(self) -> None:
+        """
+        Release the connection
+
+        :return: None
+        """
+
+
+@pytest.fixture(name='alma')
+def fixture_alma(monkeypatch: pytest.MonkeyPatch) -> SimpleNamespace:
+    """
+    Stub the database lookups and the Alma API
+
+    Each lookup records its name in ``lookups``. Each API call records its payload
+    and returns the next of ``bodies``, which is fed to the parser a few bytes at a
+    time so text is split across chunks.
+
+    :param monkeypatch: pytest monkeypatch fixture
+    :return: Namespace with the lookups made, the payloads sent and the bodies to return
+    """
+    alma = SimpleNamespace(payloads=[], bodies=[], lookups=[])
+
+    def stub(name: str, lookup: Callable[..., Any]) -> None:
+        def record(*args: Any) -> Any:
+            alma.lookups.append(name)
+            return lookup(*args)
+
+        monkeypatch.setattr(function_app, name, record)
+
+    stub('_area', lambda name, epoch: SimpleNamespace(id=1))
+    stub('_iz', lambda code, epoch: SimpleNamespace(id=2, code=code))
+    stub('_analysis', lambda name, epoch: SimpleNamespace(name=name))
+    stub('_iz_analysis', lambda code, name, epoch: SimpleNamespace(path='/shared/r'))
+    stub('_apikey', lambda area_id, iz_id, epoch: SimpleNamespace(apikey='KEY'))
+
+    async def make_api_call(payload: dict[str, str]) -> FakeResponse:
+        alma.payloads.append(dict(payload))
+        return FakeResponse(alma.bodies.pop(0))
+
+    monkeypatch.setattr(function_app, 'make_api_call', make_api_call)
+    monkeypatch.setattr(function_app, 'CHUNK_SIZE', 7)
+
+    return alma
+
+
+def call(body: dict[str, Any] | bytes) -> func.HttpResponse:
+    """
+    Invoke the function with a JSON request body
+
+    :param body: Request body, encoded as JSON unless already bytes
+    :return: func.HttpResponse
+    """
+    handler = function_app.httpalmaanalytics.build().get_user_function()
+    req = func.HttpRequest(
+        'POST', '/api/httpalmaanalytics', body=body if isinstance(body, bytes) else json.dumps(body).encode()
+    )
+
+    return asyncio.run(handler(req))
+
+
+def test_pages_follow_the_first_page_token(alma: SimpleNamespace) -> None:
+    """
+    Follow-up pages reuse the resume token returned by the first page
+    """
+    alma.bodies = [FIRST_PAGE, continuation_page('b2'), continuation_page('b3', 'true')]
+
+    res = call({'iz': '01', 'analysis': 'a', 'pages': 3})
+    data = json.loads(res.get_body())['data']
+
+    assert res.status_code == 200
+    assert [row['Barcode'] for row in data['rows']] == ['b1', 'b2', 'b3']
+    assert alma.payloads[0]['path'] == '/shared/r'
+    assert [payload['token'] for payload in alma.payloads[1:]] == ['TOK', 'TOK']
+
+
+def test_resume_with_pages_fetches_every_page(alma: SimpleNamespace) -> None:
+    """
+    A resumed request keeps using its own token, since continuation pages carry none
+    """
+    alma.bodies = [continuation_page('b2'), continuation_page('b3'), continuation_page('b4', 'true')]
+
+    res = call({'iz': '01', 'analysis': 'a', 'resume': 'T', 'pages': 3, 'columns': {'Column1': 'Barcode'}})
+    data = json.loads(res.get_body())['data']
+
+    assert res.status_code == 200
+    assert [row['Barcode'] for row in data['rows']] == ['b2', 'b3', 'b4']
+    assert [payload['token'] for payload in alma.payloads] == ['T', 'T', 'T']
+    assert all('path' not in payload for payload in alma.payloads)
+
+
+def test_pages_stop_when_the_report_is_finished(alma: SimpleNamespace) -> None:
+    """
+    No further pages are requested once Alma reports IsFinished
+    """
+    alma.bodies = [continuation_page('b2', 'true')]
+
+    res = call({'iz': '01', 'analysis': 'a', 'resume': 'T', 'pages': 3})
+
+    assert res.status_code == 200
+    assert len(alma.payloads) == 1
+
+
+@pytest.mark.parametrize('pages', [0, function_app.MAX_PAGES + 1, '2', True])
+def test_invalid_pages_are_rejected(alma: SimpleNamespace, pages: Any) -> None:
+    """
+    pages must be an integer from 1 to MAX_PAGES, checked before any lookup
+    """
+    res = call({'iz': '01', 'analysis': 'a', 'pages': pages})
+
+    assert res.status_code == 400
+    assert not alma.lookups
+    assert not alma.payloads
+
+
+@pytest.mark.parametrize('body', [b'', b'{"iz": "01"', b'[]', b'"01"', b'null'])
+def test_request_body_must_be_a_json_object(alma: SimpleNamespace, body: bytes) -> None:
+    """
+    An empty, invalid or non-object request body is rejected
+    """
+    res = call(body)
+
+    assert res.status_code == 400
+    assert res.get_body() == b'Invalid JSON in request body'
+    assert not alma.lookups
+
+
+@pytest.mark.parametrize('body', [
+    {'analysis': 'a'},
+    {'iz': '', 'analysis': 'a'},
+    {'iz': ['01'], 'analysis': 'a'},
+    {'iz': '01', 'analysis': {'name': 'a'}},
+    {'iz': '01', 'analysis': 'a', 'resume': 5},
+])
+def test_request_parameters_must_be_strings(alma: SimpleNamespace, body: dict[str, Any]) -> None:
+    """
+    iz and analysis are required strings, and resume is a string when present
+    """
+    res = call(body)
+
+    assert res.status_code == 400
+    assert res.get_body() == b'Pass iz, and analysis in the request body'
+    assert not alma.lookups
+
+
+REPORT = (
+    b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    b'<report>\n<QueryResult>\n<ResumptionToken>0D5C8E8F2A6B</ResumptionToken>\n<IsFinished>false</IsFinished>\n'
+    b'<ResultXml><rowset xmlns="urn:schemas-microsoft-com:xml-analysis:rowset">'
+    b'<xsd:schema xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:saw-sql="urn:saw-sql"'
+    b' targetNamespace="urn:schemas-microsoft-com:xml-analysis:rowset">'
+    b'<xsd:complexType name="Row"><xsd:sequence>'
+    b'<xsd:element minOccurs="0" maxOccurs="1" name="Column0" type="xsd:string" saw-sql:type="integer"'
+    b' saw-sql:columnHeading="0"/>'
+    b'<xsd:element name="Column1" type="xsd:string" saw-sql:columnHeading="Barcode"/>'
+    b'<xsd:element name="Column2" type="xsd:string"'
+    b' saw-sql:columnHeading="CASE  WHEN Provenance Code = &apos;01&apos; THEN &apos;WRLC&apos; END"/>'
+    b'<xsd:element name="Column3" type="xsd:string" saw-sql:columnHeading="Title"/>'
+    b'</xsd:sequence></xsd:complexType></xsd:schema>\n'
+    b'<Row><Column0>0</Column0><Column1>31234000123456</Column1><Column2>WRLC</Column2>'
+    b'<Column3>Moby-Dick; or, The Whale &amp; other stories</Column3></Row>\n'
+    b'<Row><Column0>0</Column0><Column1>31234000654321</Column1><Column2/><Column3>Walden</Column3></Row>\n'
+    b'</rowset></ResultXml>\n</QueryResult>\n</report>\n'
+)
+
+
+def test_report_rows_use_the_schema_headings(alma: SimpleNamespace) -> None:
+    """
+    Rows are keyed on the schema headings, Column0 is skipped, the Provenance Code
+    heading is renamed and empty cells are empty strings
+    """
+    alma.bodies = [REPORT]
+
+    res = call({'iz': '01', 'analysis': 'a'})
+
+    assert res.status_code == 200
+    assert json.loads(res.get_body()) == {
+        'status': 'success',
+        'data': {
+            'resume': '0D5C8E8F2A6B',
+            'is_finished': 'false',
+            'columns': {'Column0': '0', 'Column1': 'Barcode', 'Column2': 'Provenance Code', 'Column3': 'Title'},
+            'rows': [
+                {'Barcode': '31234000123456', 'Provenance Code': 'WRLC',
+                 'Title': 'Moby-Dick; or, The Whale & other stories'},
+                {'Barcode': '31234000654321', 'Provenance Code': '', 'Title': 'Walden'},
+            ],
+        },
+    }
+
+
+def test_report_without_schema_uses_the_request_columns(alma: SimpleNamespace) -> None:
+    """
+    Without a schema, rows are keyed on the columns from the request body, falling back to the tag name
+    """
+    alma.bodies = [
+        b'<report><QueryResult><IsFinished>true</IsFinished>'
+        b'<ResultXml><rowset xmlns="urn:schemas-microsoft-com:xml-analysis:rowset">'
+        b'<Row><Column0>0</Column0><Column1>31234000123456</Column1><Column2>Walden</Column2></Row>'
+        b'</rowset></ResultXml></QueryResult></report>'
+    ]
+
+    res = call({'iz': '01', 'analysis': 'a', 'resume': 'T', 'columns': {'Column1': 'Barcode'}})
+    data = json.loads(res.get_body())['data']
+
+    assert res.status_code == 200
+    assert data['columns'] == {'Column1': 'Barcode'}
+    assert data['rows'] == [{'Barcode': '31234000123456', 'Column2': 'Walden'}]
+
+
+def test_report_without_schema_or_columns_keeps_the_tag_names(alma: SimpleNamespace) -> None:
+    """
+    Without a schema or request columns, rows are keyed on the tag names, Column0 included
+    """
+    alma.bodies = [continuation_page('b2')]
+
+    res = call({'iz': '01', 'analysis': 'a', 'resume': 'T'})
+    data = json.loads(res.get_body())['data']
+
+    assert res.status_code == 200
+    assert data['columns'] is None
+    assert data['rows'] == [{'Column0': '0', 'Column1': 'b2'}]
+
+
+API_ERROR = (
+    b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    b'<web_service_result xmlns="http://com/exlibris/urm/general/xmlbeans">'
+    b'<errorsExist>true</errorsExist><errorList><error>'
+    b'<errorCode>INTERNAL_SERVER_ERROR</errorCode><errorMessage>Path not found</errorMessage>'
+    b'</error></errorList></web_service_result>'
+)
+
+
+def test_api_error_returns_500(alma: SimpleNamespace) -> None:
+    """
+    An xmlbeans error is returned with the text of its nested elements
+    """
+    alma.bodies = [API_ERROR]
+
+    res = call({'iz': '01', 'analysis': 'a'})
+
+    assert res.status_code == 500
+    assert res.get_body() == b'Error: INTERNAL_SERVER_ERRORPath not found'
+
+
+@pytest.mark.parametrize('body', [b'', b'<report><QueryResult><IsFinished>true', b'Service Unavailable'])
+def test_invalid_xml_returns_404(alma: SimpleNamespace, body: bytes) -> None:
+    """
+    An empty, truncated or non-XML response is rejected
+    """
+    alma.bodies = [body]
+
+    res = call({'iz': '01', 'analysis': 'a'})
+
+    assert res.status_code == 404
+    assert res.get_body() == b'Empty or invalid XML response'
+
+
+def test_report_without_rows_returns_404(alma: SimpleNamespace) -> None:
+    """
+    A report page with no rows is not found
+    """
+    alma.bodies = [REPORT.partition(b'<Row>')[0] + b'</rowset></ResultXml></QueryResult></report>']
+
+    res = call({'iz': '01', 'analysis': 'a'})
+
+    assert res.status_code == 404
+    assert res.get_body() == b'No rows found'
+
+
+def test_pooled_parser_reads_the_next_report(alma: SimpleNamespace, monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    A parser returned to the pool keeps none of its report and parses the next one afresh
+    """
+    monkeypatch.setattr(function_app, 'PARSERS', [])
+    alma.bodies = [REPORT, continuation_page('b2', 'true')]
+
+    call({'iz': '01', 'analysis': 'a'})
+    pooled = list(function_app.PARSERS)
+    target = pooled[0][1]
+
+    assert len(pooled) == 1
+    assert (target.report, target.columns, target.rows, target.keys) == ({}, None, [], {})
+
+    res = call({'iz': '01', 'analysis': 'a', 'resume': 'T', 'columns': {'Column1': 'Barcode'}})
+    data = json.loads(res.get_body())['data']
+
+    assert res.status_code == 200
+    assert data == {
+        'resume': None, 'is_finished': 'true', 'columns': {'Column1': 'Barcode'}, 'rows': [{'Barcode': 'b2'}]
+    }
+    assert function_app.PARSERS == pooled
+
+
+@pytest.mark.parametrize('body', [API_ERROR, b'<report><QueryResult><IsFinished>true'])
+def test_abandoned_parser_is_not_pooled(
+        alma: SimpleNamespace, monkeypatch: pytest.MonkeyPatch, body: bytes
+) -> None:
+    """
+    A parser that stopped on an API error or invalid XML is discarded rather than returned to the pool
+    """
+    monkeypatch.setattr(function_app, 'PARSERS', [])
+    alma.bodies = [REPORT, body, REPORT]
+
+    call({'iz': '01', 'analysis': 'a'})
+    pooled = function_app.PARSERS[0]
+
+    assert call({'iz': '01', 'analysis': 'a'}).status_code in (404, 500)
+    assert not function_app.PARSERS
+
+    assert call({'iz': '01', 'analysis': 'a'}).status_code == 200
+    assert function_app.PARSERS[0] is not pooled
+
+
+def api_call(monkeypatch: pytest.MonkeyPatch, statuses: list[int]) -> SimpleNamespace:
+    """
+    Call make_api_call against a local server that answers with each of ``statuses`` in turn
+
+    :param monkeypatch: pytest monkeypatch fixture
+    :param statuses: HTTP status of each response
+    :return: Namespace with the status and body returned, the requests served and the statuses of responses released
+    """
+    result = SimpleNamespace(requests=0, released=[])
+    responses: list[aiohttp.ClientResponse] = []  # Each response released, once
+    release = aiohttp.ClientResponse.release
+
+    def spy(response: aiohttp.ClientResponse) -> Any:
+        if all(response is not seen for seen in responses):
+            responses.append(response)
+            result.released.append(response.status)
+        return release(response)
+
+    monkeypatch.setattr(aiohttp.ClientResponse, 'release', spy)
+    monkeypatch.setattr(function_app, 'RETRY_BACKOFF', 0)
+    monkeypatch.setattr(function_app, 'SESSION', None)
+
+    async def handler(request: web.Request) -> web.Response:
+        result.requests += 1
+        return web.Response(status=statuses[result.requests - 1], body=request.query_string.encode())
+
+    async def run() -> None:
+        server = web.Application()
+        server.router.add_get('/almaws/v1/analytics/reports', handler)
+        runner = web.AppRunner(server)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', 0).start()
+        host, port = runner.addresses[0][:2]
+        monkeypatch.setattr(function_app, 'ALMA_ANALYTICS_URL', f'http://{host}:{port}/almaws/v1/analytics/reports')
+
+        try:
+            response = await function_app.make_api_call({'path': '/shared/r'})
+            if isinstance(response, func.HttpResponse):
+                result.status, result.body = response.status_code, response.get_body()
+            else:
+                result.status, result.body = response.status, await response.read()
+                response.release()
+        finally:
+            await (await function_app.get_session()).close()
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+    return result
+
+
+def test_api_call_retries_unavailable_responses(monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    A 503 is released and retried, and the next response is returned
+    """
+    result = api_call(monkeypatch, [503, 200])
+
+    assert (result.status, result.body) == (200, b'path=/shared/r')
+    assert result.requests == 2
+    assert result.released == [503, 200]
+
+
+def test_api_call_fails_at_once_on_client_errors(monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    A 4xx is not retried; its response is released and the call fails with 500
+    """
+    result = api_call(monkeypatch, [400])
+
+    assert result.status == 500
+    assert result.body.startswith(b'API call failed: 400')
+    assert result.requests == 1
+    assert result.released == [400]
+
+
+def test_api_call_fails_after_the_last_retry(monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    The call fails with 500 once RETRY_TOTAL retries have all been unavailable
+    """
+    statuses = [502, 503, 504, 503][:function_app.RETRY_TOTAL + 1]
+
+    result = api_call(monkeypatch, statuses)
+
+    assert result.status == 500
+    assert result.body.startswith(f'API call failed: {statuses[-1]}'.encode())
+    assert result.requests == function_app.RETRY_TOTAL + 1
+    assert result.released == statuses
+
+
+def cached_lookup(results: dict[str, Any]) -> tuple[Any, list[tuple[str, int]]]:
+    """
+    Build a lookup wrapped in cache_found that records its calls
+
+    :param results: Result for each key; missing keys return None
+    :return: Cached lookup and the list of calls that reached it
+    """
+    calls: list[tuple[str, int]] = []
+
+    @function_app.cache_found(maxsize=2)
+    def lookup(key: str, epoch: int) -> Any:
+        calls.append((key, epoch))
+        return results.get(key)
+
+    return lookup, calls
+
+
+def test_cache_found_returns_cached_hits() -> None:
+    """
+    A hit returns the cached object without calling the lookup again
+    """
+    found = object()
+    lookup, calls = cached_lookup({'a': found})
+
+    assert lookup('a', 0) is found
+    assert lookup('a', 0) is found
+    assert calls == [('a', 0)]
+
+
+def test_cache_found_does_not_cache_misses() -> None:
+    """
+    A lookup that found nothing is repeated, so a record added later is found
+    """
+    results: dict[str, Any] = {}
+    lookup, calls = cached_lookup(results)
+
+    assert lookup('a', 0) is None
+    results['a'] = found = object()
+
+    assert lookup('a', 0) is found
+    assert lookup('a', 0) is found
+    assert calls == [('a', 0), ('a', 0)]
+
+
+def test_cache_found_evicts_the_least_recently_used() -> None:
+    """
+    Past maxsize, the entry used longest ago is dropped
+    """
+    lookup, calls = cached_lookup({'a': 1, 'b': 2, 'c': 3})
+
+    lookup('a', 0)
+    lookup('b', 0)
+    lookup('a', 0)  # b is now the least recently used
+    lookup('c', 0)
+    calls.clear()
+
+    lookup('a', 0)
+    lookup('c', 0)
+    lookup('b', 0)
+
+    assert calls == [('b', 0)]
+
+
+def test_cache_found_expires_with_the_epoch() -> None:
+    """
+    A new cache epoch forces a fresh lookup
+    """
+    lookup, calls = cached_lookup({'a': 1})
+
+    lookup('a', 0)
+    lookup('a', 1)
+
+    assert calls == [('a', 0), ('a', 1)]